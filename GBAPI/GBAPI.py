@@ -1,13 +1,32 @@
 #!/usr/bin/env python
 "GBAPI library and GBXML parser"
 
+import os
 import re
+import bz2
+import gzip
+import weakref
 import datetime
 
 from requests_oauthlib import OAuth2Session
 from xml.etree import ElementTree
 from xml.dom import minidom
 
+try:
+    from sys import intern as _intern
+except ImportError:
+    _intern = intern
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 __author__ = "Clay Teeter"
 __copyright__ = "Copyright 2015, Maalka.com"
 __credits__ = []
@@ -27,6 +46,82 @@ def string_to_dict(string):
         ret[kv[0]] = kv[1]
     return ret
 
+def intern_string(value):
+    ## Python 2 can only intern str, non-ASCII text comes back from ElementTree as unicode
+    return _intern(value) if isinstance(value, str) else value
+
+def intern_text(node):
+    ## codes like uom/kind repeat in every entry of a feed, share a single copy
+    return intern_string(node.text)
+
+class FrozenDict(dict):
+    "dict that rejects modification, used for the nested values of shared entries"
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Shared entries are read-only")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(x) for x in value)
+    if isinstance(value, dict) and not isinstance(value, FrozenDict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    return value
+
+def _open_xz(source):
+    if lzma is None:
+        raise Exception("Reading .xz files requires the lzma module")
+    return lzma.open(source, 'rb')
+
+def _open_zstd(source):
+    if zstandard is None:
+        raise Exception("Reading .zst files requires the zstandard package")
+    if hasattr(source, 'read'):
+        return zstandard.ZstdDecompressor().stream_reader(source, closefd = False)
+    return zstandard.ZstdDecompressor().stream_reader(open(source, 'rb'))
+
+def _open_gzip(source):
+    if hasattr(source, 'read'):
+        return gzip.GzipFile(fileobj = source, mode = 'rb')
+    return gzip.open(source, 'rb')
+
+## [extension, magic bytes, opener], openers accept a path or a readable file object
+COMPRESSED_OPENERS = [['.gz', b'\x1f\x8b', _open_gzip],
+                      ['.bz2', b'BZh', lambda source: bz2.BZ2File(source, 'rb')],
+                      ['.xz', b'\xfd7zXZ\x00', _open_xz],
+                      ['.zst', b'\x28\xb5\x2f\xfd', _open_zstd]]
+
+def open_source_file(source_file):
+    """
+    Open a GB XML source file as a byte stream.  .gz, .bz2, .xz and .zst archives are
+    decompressed on the fly as the parser reads them.  Readable file objects are read from
+    their current position; seekable ones are sniffed for the same formats by their magic bytes.
+    """
+    if hasattr(source_file, 'read'):
+        if not (hasattr(source_file, 'seekable') and source_file.seekable()):
+            return source_file
+        position = source_file.tell()
+        head = source_file.read(6)
+        source_file.seek(position)
+        for extension, magic, opener in COMPRESSED_OPENERS:
+            if head.startswith(magic):
+                return opener(source_file)
+        return source_file
+    path = os.fspath(source_file) if hasattr(os, 'fspath') else str(source_file)
+    for extension, magic, opener in COMPRESSED_OPENERS:
+        if path.lower().endswith(extension):
+            return opener(path)
+    return open(path, 'rb')
+
+def parse_source_file(source_file):
+    fh = open_source_file(source_file)
+    try:
+        return ElementTree.parse(fh).getroot()
+    finally:
+        if fh is not source_file:
+            fh.close()
+
 def convert_to_python_name(name):
     s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
     return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
@@ -49,10 +144,13 @@ class GBAPIObject(object):
                       ['LocalTimeParameters', 'GBAPILocalTimeParameters'],
                       ['ElectricPowerUsageSummary', 'GBAPIElectricPowerUsageSummary'],
                       ['ElectricPowerQualitySummary', 'GBAPIElectricPowerQualitySummary']]
+    ## entries that repeat unchanged across a feed, these are shared through the GBAPI identity map
+    __shared_entity_types = ['ApplicationInformation', 'ReadingType', 'LocalTimeParameters']
+    __read_only = False
                       
     def __init__(self, gbapi, et, ignore_entries=False):
         self.gbapi = gbapi
-        self.element_type = et.tag.split("}")[-1]
+        self.element_type = intern_string(et.tag.split("}")[-1])
         self.et = et
         self.__links = {}
         self.elements = []
@@ -60,10 +158,29 @@ class GBAPIObject(object):
         if not ignore_entries:
             self.__parse_entry()
 
+    def __setattr__(self, name, value):
+        if self.__read_only:
+            raise AttributeError("Shared %s entries are read-only" % self.element_type)
+        super(GBAPIObject, self).__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if self.__read_only:
+            raise AttributeError("Shared %s entries are read-only" % self.element_type)
+        super(GBAPIObject, self).__delattr__(name)
+
+    def _make_read_only(self):
+        ## lists and dicts are frozen all the way down so shared entries can't be modified in place either
+        for name, value in list(self.__dict__.items()):
+            if isinstance(value, (list, tuple, dict)):
+                self.__dict__[name] = freeze(value)
+        super(GBAPIObject, self).__setattr__('_GBAPIObject__read_only', True)
+
     def self(self):
         return self.follow("self")
 
     def links(self): 
+        if self.__read_only:
+            return dict(self.__links)
         return self.__links
 
     def get_links(self):
@@ -97,7 +214,7 @@ class GBAPIObject(object):
                         break
 
                 link_key = convert_to_python_name(link_key)
-            self.__links[link_key] = node.attrib['href']
+            self.__links[intern_string(link_key)] = intern_string(node.attrib['href'])
 
     def __parse_entry(self):
         entries = self.et.findall('ns3:entry', NAMESPACES)
@@ -109,9 +226,26 @@ class GBAPIObject(object):
             content = entry.find('ns3:content', NAMESPACES)
             for entity_type in self.__entity_types:
                 for ai_element in content.findall("espi:%s" % entity_type[0], NAMESPACES):
+                    self.elements.append(self.__build_entity(entity_type, entry, ai_element))
+
+    def __build_entity(self, entity_type, entry, ai_element):
+        element = None
+        if self.gbapi is not None and entity_type[0] in self.__shared_entity_types:
+            self_link = entry.find("ns3:link[@rel='self']", NAMESPACES)
+            updated = entry.find("ns3:updated", NAMESPACES)
+            if self_link is not None and updated is not None:
+                key = (entity_type[0], intern_string(self_link.attrib['href']))
+                element = self.gbapi._get_shared_entity(key, updated.text)
+                if element is None:
                     element = globals()[entity_type[1]](self.gbapi, entry, ai_element)
                     element.element_type = entity_type[0]
-                    self.elements.append(element)
+                    element._make_read_only()
+                    self.gbapi._set_shared_entity(key, element)
+                return element
+
+        element = globals()[entity_type[1]](self.gbapi, entry, ai_element)
+        element.element_type = entity_type[0]
+        return element
 
     def __str__(self):
         kv = [' --element_type: %s' % self.element_type]
@@ -242,7 +376,7 @@ class GBAPIUsagePoint(GBAPIObjectEntity):
                     ['ServiceDeliveryPoint', 'ServiceDeliveryPoint']]
 
     class ServiceCategory(GBAPIObjectEntity.BaseSubNode):
-        entity_tags = [['kind', lambda x: x.text]]
+        entity_tags = [['kind', intern_text]]
 
     class ServiceDeliveryPoint(GBAPIObjectEntity.BaseSubNode):
         entity_tags = [['name', lambda x: x.text],
@@ -262,17 +396,17 @@ class GBAPIIntervalBlock(GBAPIObjectEntity):
     
 
 class GBAPIReadingType(GBAPIObjectEntity):
-    entity_tags = [['accumulationBehaviour', lambda x: x.text],
-                   ['commodity', lambda x: x.text],
-                   ['currency', lambda x: x.text],
-                   ['dataQualifier', lambda x: x.text],
-                   ['flowDirection', lambda x: x.text],
-                   ['intervalLength', lambda x: x.text],
-                   ['kind', lambda x: x.text],
-                   ['phase', lambda x: x.text],
-                   ['powerOfTenMultiplier', lambda x: x.text],
-                   ['timeAttribute', lambda x: x.text],
-                   ['uom', lambda x: x.text]]
+    entity_tags = [['accumulationBehaviour', intern_text],
+                   ['commodity', intern_text],
+                   ['currency', intern_text],
+                   ['dataQualifier', intern_text],
+                   ['flowDirection', intern_text],
+                   ['intervalLength', intern_text],
+                   ['kind', intern_text],
+                   ['phase', intern_text],
+                   ['powerOfTenMultiplier', intern_text],
+                   ['timeAttribute', intern_text],
+                   ['uom', intern_text]]
 
 class GBAPIElectricPowerQualitySummary(GBAPIObjectEntity):
     pass
@@ -281,7 +415,7 @@ class GBAPIElectricPowerUsageSummary(GBAPIObjectEntity):
     entity_tags = [['billLastPeriod', lambda x: x.text],
                    ['billToDate', lambda x: x.text],
                    ['costAdditionalLastPeriod', lambda x: x.text],
-                   ['currency', lambda x: x.text],
+                   ['currency', intern_text],
                    ['qualityOfReading', lambda x: x.text],
                    ['statusTimeStamp', lambda x: x.text]]
 
@@ -294,14 +428,14 @@ class GBAPIElectricPowerUsageSummary(GBAPIObjectEntity):
         pass
 
     class OverallConsumptionLastPeriod(GBAPIObjectEntity.BaseSubNode):
-        entity_tags = [['powerOfTenMultiplier', lambda x: x.text],
-                       ['uom', lambda x: x.text],
+        entity_tags = [['powerOfTenMultiplier', intern_text],
+                       ['uom', intern_text],
                        ['value', lambda x: x.text]]
 
     class CurrentBillingPeriodOverAllConsumption(GBAPIObjectEntity.BaseSubNode):
-        entity_tags = [['powerOfTenMultiplier', lambda x: x.text],
+        entity_tags = [['powerOfTenMultiplier', intern_text],
                        ['timeStamp', lambda x: x.text],
-                       ['uom', lambda x: x.text],
+                       ['uom', intern_text],
                        ['value', lambda x: x.text]]
 
         
@@ -320,8 +454,34 @@ class GBAPI(object):
         else:
             self.__GB_Request = None
         self.__source_file = source_file
+        self.__source_position = None
+        if hasattr(source_file, 'read'):
+            ## every request re-parses the source, so file objects are rewound to here first
+            if not (hasattr(source_file, 'seekable') and source_file.seekable()):
+                raise Exception("source_file objects must be seekable")
+            self.__source_position = source_file.tell()
+        ## identity map of the shared, read-only ApplicationInformation, ReadingType and
+        ## LocalTimeParameters entries, keyed by (entity type, self href).  Values are weak so
+        ## entries are dropped once no result references them.
+        self.__entities = weakref.WeakValueDictionary()
+
+    def _get_shared_entity(self, key, updated):
+        entity = self.__entities.get(key)
+        if entity is None or entity.updated != updated:
+            return None
+        return entity
+
+    def _set_shared_entity(self, key, entity):
+        ## replaces any older version of the same entry
+        self.__entities[key] = entity
+
+    def clear_entity_cache(self):
+        self.__entities.clear()
 
     def get_ApplicationInformation(self, application_information_id = None):
+        """
+        ApplicationInformation entries are shared between results and are read-only.
+        """
         path = "ApplicationInformation"
 
         if application_information_id is not None:
@@ -357,6 +517,9 @@ class GBAPI(object):
         return g
 
     def get_ReadingType(self, reading_type_id=None):
+        """
+        ReadingType entries are shared between results and are read-only.
+        """
         path = "ReadingType"
 
         if reading_type_id is not None:
@@ -382,6 +545,9 @@ class GBAPI(object):
         return g
 
     def get_LocalTimeParameters(self, local_time_parameter_id=None):
+        """
+        LocalTimeParameters entries are shared between results and are read-only.
+        """
         path = "LocalTimeParameters"
 
         if local_time_parameter_id is not None:
@@ -451,21 +617,33 @@ class GBAPI(object):
     def load_entire_file(self):
         ## most get opperations will work on static files, this is just a convience function
         ## to return all entries...  
-        et = ElementTree.parse(self.__source_file).getroot()
+        et = self.__parse_source_file()
         return [GBAPIObject(self, x) for x in et.findall("{%s}entry" % NAMESPACES['ns3'])]
 
-    def _generic_request(self, path, absolute = False):
-        if self.__source_file is None:
-            if absolute: 
-                response = self.__GB_Request.get(path)
-            else:
-                path = "/espi/1_1/resource/%s" % (path,) 
-                response = self.__GB_Request.get("%s%s" % (self.__BASEURL, path))
+    def __parse_source_file(self):
+        if self.__source_position is not None:
+            self.__source_file.seek(self.__source_position)
+        return parse_source_file(self.__source_file)
+
+    def __fetch(self, url):
+        ## stream the (gzip/deflate) response body straight into the parser rather than
+        ## decoding the whole payload into a str first
+        response = self.__GB_Request.get(url, stream = True)
+        try:
             if response.status_code != 200:
                 raise RequestFailedException()
-            et = ElementTree.fromstring(response.text)
+            response.raw.decode_content = True
+            return ElementTree.parse(response.raw).getroot()
+        finally:
+            response.close()
+
+    def _generic_request(self, path, absolute = False):
+        if self.__source_file is None:
+            if not absolute: 
+                path = "%s/espi/1_1/resource/%s" % (self.__BASEURL, path)
+            et = self.__fetch(path)
         else:
-            et = ElementTree.parse(self.__source_file).getroot()
+            et = self.__parse_source_file()
             et_filtered = et.find("{%(ns)s}entry/{%(ns)s}link[@rel='self'][@href='%(path)s'].." % {'ns': NAMESPACES['ns3'], 
                                                                                                      'path': path})
             if et_filtered is None:
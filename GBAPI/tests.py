@@ -1,7 +1,52 @@
 #!/usr/bin/env python
 
+import gc
+import io
+import os
+import bz2
+import gzip
+import shutil
+import tempfile
 import unittest
+import weakref
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from urllib3.response import HTTPResponse
+
+import GBAPI as gbapi_module
 from GBAPI import GBAPI, RequestFailedException
+
+FEED_XML = b"""<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:espi="http://naesb.org/espi">
+  <id>urn:uuid:feed</id>
+  <title>Green Button Feed</title>
+  <updated>2015-01-01T00:00:00Z</updated>
+  <entry>
+    <id>urn:uuid:ltp</id>
+    <title>DST For North America</title>
+    <updated>2015-01-01T00:00:00Z</updated>
+    <link rel="self" href="LocalTimeParameters/01"/>
+    <link rel="up" href="LocalTimeParameters"/>
+    <content>
+      <espi:LocalTimeParameters>
+        <espi:dstEndRule>B40E2000</espi:dstEndRule>
+        <espi:dstOffset>3600</espi:dstOffset>
+        <espi:dstStartRule>360E2000</espi:dstStartRule>
+        <espi:tzOffset>-18000</espi:tzOffset>
+      </espi:LocalTimeParameters>
+    </content>
+  </entry>
+</feed>
+"""
 class BaseGBAPITestCase(unittest.TestCase):
     def setUp(self):
         BASEURL = "https://services.greenbuttondata.org:443/DataCustodian"
@@ -203,6 +248,315 @@ class TestLocalFileSource(BaseGBAPITestCase):
         res = gb.get_LocalTimeParameters('01')
         self.assertEqual(res.element_type, "LocalTimeParameters")
 
+
+class TestCompressedLocalFileSource(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_source(self, name, opener=open):
+        source_file = os.path.join(self.tmpdir, name)
+        fh = opener(source_file, 'wb')
+        try:
+            fh.write(FEED_XML)
+        finally:
+            fh.close()
+        return source_file
+
+    def assert_source_file(self, source_file):
+        gb = GBAPI(None, None, source_file = source_file)
+        res = gb.get_LocalTimeParameters('01')
+        self.assertEqual(res.element_type, "LocalTimeParameters")
+        self.assertEqual(res.tz_offset, "-18000")
+        self.assertEqual(len(gb.load_entire_file()), 1)
+
+    def test_plain(self):
+        self.assert_source_file(self.write_source('feed.xml'))
+
+    def test_gzip(self):
+        self.assert_source_file(self.write_source('feed.xml.gz', gzip.open))
+
+    def test_bz2(self):
+        self.assert_source_file(self.write_source('feed.xml.bz2', bz2.BZ2File))
+
+    @unittest.skipIf(lzma is None, "lzma is not installed")
+    def test_xz(self):
+        self.assert_source_file(self.write_source('feed.xml.xz', lzma.open))
+
+    @unittest.skipIf(zstandard is None, "zstandard is not installed")
+    def test_zst(self):
+        source_file = os.path.join(self.tmpdir, 'feed.xml.zst')
+        with open(source_file, 'wb') as fh:
+            fh.write(zstandard.ZstdCompressor().compress(FEED_XML))
+        self.assert_source_file(source_file)
+
+    def test_zst_without_zstandard(self):
+        source_file = os.path.join(self.tmpdir, 'feed.xml.zst')
+        with open(source_file, 'wb') as fh:
+            fh.write(FEED_XML)
+        installed = gbapi_module.zstandard
+        gbapi_module.zstandard = None
+        try:
+            gb = GBAPI(None, None, source_file = source_file)
+            self.assertRaises(Exception, gb.load_entire_file)
+        finally:
+            gbapi_module.zstandard = installed
+
+    def test_path_object(self):
+        try:
+            import pathlib
+        except ImportError:
+            self.skipTest("pathlib is not available")
+        self.assert_source_file(pathlib.Path(self.write_source('feed.xml.gz', gzip.open)))
+
+    def test_file_object(self):
+        source_file = io.BytesIO(FEED_XML)
+        gb = GBAPI(None, None, source_file = source_file)
+        self.assertEqual(len(gb.load_entire_file()), 1)
+        res = gb.get_LocalTimeParameters('01')
+        self.assertEqual(res.element_type, "LocalTimeParameters")
+        self.assertEqual(len(gb.load_entire_file()), 1)
+        self.assertFalse(source_file.closed)
+
+    def test_compressed_file_objects(self):
+        sources = [self.write_source('gzip', gzip.open),
+                   self.write_source('bz2', bz2.BZ2File)]
+        if lzma is not None:
+            sources.append(self.write_source('xz', lzma.open))
+        if zstandard is not None:
+            sources.append(os.path.join(self.tmpdir, 'zst'))
+            with open(sources[-1], 'wb') as fh:
+                fh.write(zstandard.ZstdCompressor().compress(FEED_XML))
+        for source_file in sources:
+            with open(source_file, 'rb') as fh:
+                gb = GBAPI(None, None, source_file = fh)
+                self.assertEqual(len(gb.load_entire_file()), 1)
+                res = gb.get_LocalTimeParameters('01')
+                self.assertEqual(res.tz_offset, "-18000")
+                self.assertFalse(fh.closed)
+
+    def test_unseekable_file_object(self):
+        class Unseekable(object):
+            def read(self, size=-1):
+                return b""
+            def seekable(self):
+                return False
+        self.assertRaises(Exception, GBAPI, None, None, source_file = Unseekable())
+
+SHARED_FEED_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom" xmlns:espi="http://naesb.org/espi">
+  <id>urn:uuid:feed</id>
+  <title>Green Button Feed</title>
+  <updated>2015-01-01T00:00:00Z</updated>
+  <entry>
+    <id>urn:uuid:ai</id>
+    <title>Application Information</title>
+    <updated>2015-01-01T00:00:00Z</updated>
+    <link rel="self" href="ApplicationInformation/01"/>
+    <link rel="up" href="ApplicationInformation"/>
+    <content>
+      <espi:ApplicationInformation>
+        <espi:grant_types>authorization_code,refresh_token</espi:grant_types>
+        <espi:scope>FB=4_5_15;IntervalDuration=3600</espi:scope>
+      </espi:ApplicationInformation>
+    </content>
+  </entry>
+  <entry>
+    <id>urn:uuid:ltp</id>
+    <title>DST For North America</title>
+    <updated>2015-01-01T00:00:00Z</updated>
+    <link rel="self" href="LocalTimeParameters/01"/>
+    <link rel="up" href="LocalTimeParameters"/>
+    <content>
+      <espi:LocalTimeParameters>
+        <espi:tzOffset>-18000</espi:tzOffset>
+      </espi:LocalTimeParameters>
+    </content>
+  </entry>
+  <entry>
+    <id>urn:uuid:rt</id>
+    <title>Energy Delivered (kWh)</title>
+    <updated>%(reading_type_updated)s</updated>
+    <link rel="self" href="ReadingType/07"/>
+    <link rel="up" href="ReadingType"/>
+    <content>
+      <espi:ReadingType>
+        <espi:kind>12</espi:kind>
+        <espi:uom>72</espi:uom>
+      </espi:ReadingType>
+    </content>
+  </entry>
+  <entry>
+    <id>urn:uuid:mr</id>
+    <title>Monthly Electricity Consumption</title>
+    <updated>2015-01-01T00:00:00Z</updated>
+    <link rel="self" href="MeterReading/01"/>
+    <link rel="up" href="MeterReading"/>
+    <content>
+      <espi:MeterReading/>
+    </content>
+  </entry>
+  <entry>
+    <id>urn:uuid:ib</id>
+    <title>Interval Block</title>
+    <updated>2015-01-01T00:00:00Z</updated>
+    <link rel="self" href="IntervalBlock/01"/>
+    <link rel="up" href="IntervalBlock"/>
+    <content>
+      <espi:IntervalBlock>
+        <espi:interval><espi:duration>3600</espi:duration><espi:start>1420070400</espi:start></espi:interval>
+        <espi:IntervalReading><espi:value>450</espi:value></espi:IntervalReading>
+      </espi:IntervalBlock>
+    </content>
+  </entry>
+</feed>
+"""
+
+class TestSharedEntities(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source_file = os.path.join(self.tmpdir, 'feed.xml')
+        self.write_source('2015-01-01T00:00:00Z')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_source(self, reading_type_updated):
+        with open(self.source_file, 'w') as fh:
+            fh.write(SHARED_FEED_XML % {'reading_type_updated': reading_type_updated})
+
+    def load_entities(self, gb):
+        entities = {}
+        for entry in gb.load_entire_file():
+            for element in entry.elements:
+                entities[element.element_type] = element
+        return entities
+
+    def test_shared_entity_types(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        first = self.load_entities(gb)
+        second = self.load_entities(gb)
+        for element_type in ['ApplicationInformation', 'ReadingType', 'LocalTimeParameters']:
+            self.assertIs(first[element_type], second[element_type])
+        self.assertIs(gb.get_ReadingType('07'), first['ReadingType'])
+        self.assertIs(gb.get_LocalTimeParameters('01'), first['LocalTimeParameters'])
+        self.assertIs(gb.get_ApplicationInformation('01'), first['ApplicationInformation'])
+
+    def test_unshared_entity_types(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        first = self.load_entities(gb)
+        second = self.load_entities(gb)
+        for element_type in ['MeterReading', 'IntervalBlock']:
+            self.assertIsNot(first[element_type], second[element_type])
+
+    def test_updated_entry_replaces_shared_entity(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        old = gb.get_ReadingType('07')
+        self.write_source('2015-02-01T00:00:00Z')
+        new = gb.get_ReadingType('07')
+        self.assertIsNot(old, new)
+        self.assertEqual(new.updated, '2015-02-01T00:00:00Z')
+        self.assertIs(gb.get_ReadingType('07'), new)
+
+    def test_shared_entities_are_released(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        ref = weakref.ref(gb.get_ReadingType('07'))
+        gc.collect()
+        self.assertIsNone(ref())
+
+    def test_clear_entity_cache(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        res = gb.get_ReadingType('07')
+        gb.clear_entity_cache()
+        self.assertIsNot(gb.get_ReadingType('07'), res)
+
+    def test_shared_entities_are_read_only(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        res = gb.get_ApplicationInformation('01')
+        self.assertRaises(AttributeError, setattr, res, 'uom', '38')
+        self.assertRaises(AttributeError, setattr, res, 'element_type', 'ReadingType')
+        self.assertRaises(AttributeError, delattr, res, 'grant_types')
+        self.assertEqual(res.grant_types, ('authorization_code', 'refresh_token'))
+        self.assertEqual(res.scope, ({'FB': '4_5_15', 'IntervalDuration': '3600'},))
+        self.assertRaises(TypeError, res.scope[0].__setitem__, 'FB', 'x')
+        self.assertRaises(TypeError, res.scope[0].update, {'FB': 'x'})
+        self.assertRaises(TypeError, res.scope[0].pop, 'FB')
+        self.assertEqual(gb.get_ApplicationInformation('01').scope[0]['FB'], '4_5_15')
+        res.links()['self'] = 'changed'
+        self.assertEqual(res.links()['self'], 'ApplicationInformation/01')
+
+    def test_unshared_entities_are_writable(self):
+        gb = GBAPI(None, None, source_file = self.source_file)
+        res = gb.get_MeterReading(meter_reading_id = '01')
+        res.title = 'changed'
+        self.assertEqual(res.title, 'changed')
+
+    def test_strings_are_interned(self):
+        r1 = GBAPI(None, None, source_file = self.source_file).get_ReadingType('07')
+        r2 = GBAPI(None, None, source_file = self.source_file).get_ReadingType('07')
+        self.assertIsNot(r1, r2)
+        self.assertIs(r1.uom, r2.uom)
+        self.assertIs(r1.kind, r2.kind)
+        self.assertIs(r1.element_type, r2.element_type)
+        self.assertIs(r1.links()['self'], r2.links()['self'])
+        self.assertIs(r1.links()['up'], r2.links()['up'])
+
+class FakeResponse(object):
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        compressed = io.BytesIO()
+        with gzip.GzipFile(fileobj = compressed, mode = 'wb') as fh:
+            fh.write(body)
+        compressed.seek(0)
+        self.raw = HTTPResponse(body = compressed,
+                                headers = {'Content-Encoding': 'gzip'},
+                                status = status_code,
+                                preload_content = False,
+                                decode_content = False)
+        self.closed = False
+
+    @property
+    def text(self):
+        raise AssertionError("response.text should not be used")
+
+    def close(self):
+        self.closed = True
+
+class FakeSession(object):
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append((url, kwargs))
+        return self.response
+
+class TestFetch(BaseGBAPITestCase):
+    def use_response(self, response):
+        session = FakeSession(response)
+        self.GBAPI._GBAPI__GB_Request = session
+        return session
+
+    def test_fetch_streams_gzip_response(self):
+        response = FakeResponse(200, FEED_XML)
+        session = self.use_response(response)
+        res = self.GBAPI.get_LocalTimeParameters()
+        self.assertEqual(res.element_type, "feed")
+        self.assertEqual(res.elements[0].tz_offset, "-18000")
+        url, kwargs = session.requests[0]
+        self.assertTrue(url.endswith("/espi/1_1/resource/LocalTimeParameters"))
+        self.assertTrue(kwargs.get('stream'))
+        self.assertTrue(response.raw.decode_content)
+        self.assertTrue(response.closed)
+
+    def test_fetch_failed_request(self):
+        response = FakeResponse(404, b"")
+        self.use_response(response)
+        self.assertRaises(RequestFailedException, self.GBAPI.get_LocalTimeParameters)
+        self.assertTrue(response.closed)
+
 if __name__ == "__main__":
     unittest.main()
 